@@ -1,6 +1,7 @@
 import numpy as np
 from torchvision import models
 import torch
+import torch.nn.functional as F
 import argparse
 import json
 from PIL import Image
@@ -54,11 +55,9 @@ def load_model(model_checkpoint):
     checkpoint = torch.load(model_checkpoint)
     
     arch = checkpoint["arch"]
-    my_local = dict()
-    exec("model = models.{}(pretrained=True)".format(arch), globals(), my_local)
+    model_fn = getattr(models, arch)
+    model = model_fn(weights='DEFAULT')
 
-    model =  my_local['model']
-    
     for param in model.parameters():
         param.requires_grad = False
 
@@ -94,9 +93,11 @@ def predict(image_path, model_checkpoint, topk=5, device="cpu"):
     img_tensor = torch.from_numpy(img).type(torch.FloatTensor).to(device)
     
     with torch.no_grad():
-        log_probabilities = model.forward(img_tensor)
-    
-    probabilities = torch.exp(log_probabilities)
+        output = model.forward(img_tensor)
+
+    # softmax maps logits to probabilities; it is also a no-op on
+    # checkpoints whose classifier still ends in LogSoftmax
+    probabilities = F.softmax(output, dim=1)
     probs, indices = probabilities.topk(topk)
     
     probs, indices = probs.to('cpu'), indices.to('cpu')
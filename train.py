@@ -2,122 +2,465 @@ import torch
 import numpy as np
 from torch import nn, optim
 import torch.nn.functional as F
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel as DDP
+from torch.utils.data.distributed import DistributedSampler
 from torchvision import datasets, models, transforms
-from torch.utils.data import DataLoader
+from torchvision.transforms import v2
+from torch.utils.data import DataLoader, TensorDataset
+from torch.utils.checkpoint import checkpoint_sequential
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
 from PIL import Image
 from torch import Tensor
+import copy
 import shutil
 import argparse
 import os
 
 # device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def unwrap_model(model):
+    """Peels the DDP and torch.compile wrappers off a model."""
+    model = getattr(model, "module", model)
+    model = getattr(model, "_orig_mod", model)
+    return model
+
+
+def amp_dtype(device):
+    """
+    Autocast dtype for the device: BF16 where supported (Ampere+), since
+    its FP32-sized exponent needs no loss scaling, FP16 otherwise.
+    """
+    if device == "cuda" and torch.cuda.is_bf16_supported():
+        return torch.bfloat16
+    return torch.float16
+
 def validation(model, testloader, criterion, device):
-    test_loss = 0
-    accuracy = 0
+    test_loss = torch.zeros((), device=device)
+    correct = torch.zeros((), device=device)
+    total = 0
     model.to(device)
+
+    mean = torch.tensor(IMAGENET_MEAN, device=device).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD, device=device).view(1, 3, 1, 1)
+
     for images, labels in testloader:
-        images, labels = images.to(device), labels.to(device)
+        images = images.to(device, non_blocking=True)
+        if images.dim() == 4:
+            images = images.to(memory_format=torch.channels_last)
+        labels = labels.to(device, non_blocking=True)
         # images.resize_(images.shape[0], 3, 224, 224)
 
-        output = model.forward(images)
-        test_loss += criterion(output, labels).item()
+        # Normalize uint8 image batches on the device; cached feature
+        # batches arrive ready to use
+        if images.dtype == torch.uint8:
+            images = images.float().div_(255).sub_(mean).div_(std)
 
-        ps = torch.exp(output)
-        equality = (labels.data == ps.max(dim=1)[1])
-        accuracy += equality.type(torch.FloatTensor).mean()
-    
-    return test_loss, accuracy
+        with torch.autocast("cuda", dtype=amp_dtype(device), enabled=(device == "cuda")):
+            output = model(images)
+            test_loss += criterion(output, labels).detach()
+
+        # argmax over the raw outputs equals argmax over the softmax
+        correct += (output.argmax(dim=1) == labels).sum()
+        total += labels.numel()
 
+    # Single sync at the end instead of one per batch
+    return test_loss.item(), correct.item() / total
 
-def train(model, trainloader, validloader, epochs, print_every, criterion, optimizer, arch="vgg16", device='cuda', model_dir="models"):
+
+def prefetch_batches(dataloader, device):
+    """
+    Iterates over a dataloader, moving each batch to the device on a
+    dedicated copy stream so the H2D transfer of the next batch overlaps
+    with compute on the current one. Falls back to plain iteration on CPU.
+
+    Arguments:
+        dataloader: Dataloader iterator yielding (images, labels) batches.
+        device: Device the batches should be moved to.
+
+    Yields:
+        (images, labels) tuples already resident on the device.
+    """
+    if device != "cuda":
+        for images, labels in dataloader:
+            yield images.to(device), labels.to(device)
+        return
+
+    copy_stream = torch.cuda.Stream()
+
+    def stage(images, labels):
+        with torch.cuda.stream(copy_stream):
+            images = images.to(device, non_blocking=True)
+            if images.dim() == 4:
+                images = images.to(memory_format=torch.channels_last)
+            labels = labels.to(device, non_blocking=True)
+        return images, labels
+
+    def ready(images, labels):
+        # Make the compute stream wait for the copy, and keep the tensors
+        # alive until the compute stream is done with them
+        torch.cuda.current_stream().wait_stream(copy_stream)
+        images.record_stream(torch.cuda.current_stream())
+        labels.record_stream(torch.cuda.current_stream())
+        return images, labels
+
+    prefetched = None
+    for images, labels in dataloader:
+        if prefetched is not None:
+            yield ready(*prefetched)
+        prefetched = stage(images, labels)
+    if prefetched is not None:
+        yield ready(*prefetched)
+
+
+def train(model, trainloader, validloader, epochs, print_every, criterion, optimizer, scaler, arch="vgg16", device='cuda', model_dir="models"):
     epochs = epochs
     print_every = print_every
     steps = 0
     
-    # Change to train mode if not already
+    # Change to train mode if not already; the frozen backbone stays in
+    # eval mode so its BN/dropout behave as at inference
     model.train()
+    unwrap_model(model).features.eval()
     # change to cuda
     model.to(device)
 
+    # Under DDP only rank 0 writes checkpoints
+    is_main_process = not (dist.is_available() and dist.is_initialized()) or dist.get_rank() == 0
+
+    # Normalization is applied on the device against the whole uint8 batch
+    mean = torch.tensor(IMAGENET_MEAN, device=device).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD, device=device).view(1, 3, 1, 1)
+
+    # Checkpoints are serialized on a background thread: the GPU state is
+    # copied into pinned CPU shadow tensors (a quick D2H) and torch.save
+    # runs off the training loop
+    saver = ThreadPoolExecutor(max_workers=1)
+    save_future = None
+    shadow_state = None
+
+    # Kept on the GPU so accumulating the loss doesn't sync every step
+    running_loss = torch.zeros((), device=device)
+
     best_accuracy = 0
     for e in range(epochs):
-        running_loss = 0
+        if isinstance(getattr(trainloader, "sampler", None), DistributedSampler):
+            trainloader.sampler.set_epoch(e)
 
-        for (images, labels) in trainloader:
+        running_loss.zero_()
+
+        for (images, labels) in prefetch_batches(trainloader, device):
             steps += 1
 
-            images, labels = images.to(device), labels.to(device)
+            # uint8 image batches are normalized here; cached feature
+            # batches arrive ready to use
+            if images.dtype == torch.uint8:
+                images = images.float().div_(255).sub_(mean).div_(std)
 
-            optimizer.zero_grad()
+            # Freeing grads skips a memset kernel per parameter tensor
+            optimizer.zero_grad(set_to_none=True)
 
-            # Forward and backward passes
-            outputs = model.forward(images)
-            loss = criterion(outputs, labels)
-            loss.backward()
-            optimizer.step()
+            # Forward and backward passes (mixed precision on GPU)
+            with torch.autocast("cuda", dtype=amp_dtype(device), enabled=(device == "cuda")):
+                outputs = model(images)
+                loss = criterion(outputs, labels)
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
 
-            running_loss += loss.item()
+            running_loss += loss.detach()
 
             if steps % print_every == 0:
-                
-                # Make sure network is in eval mode for inference
-                model.eval()
-
-                # Turn off gradients for validation, saves memory and computations
-                with torch.no_grad():
-                    validation_loss, accuracy = validation(model, validloader, criterion, device)
-
-                print("Epoch: {}/{}.. ".format(e+1, epochs),
-                      "Training Loss: {:.3f}.. ".format(running_loss/print_every),
-                      "Validation Loss: {:.3f}.. ".format(validation_loss/len(validloader)),
-                      "Validation Accuracy: {:.3f}".format((accuracy/len(validloader))*100))
-
-                model.train()
-                
-                running_loss = 0
-        
+                # Under DDP only rank 0 validates and logs — every rank
+                # running the full unsharded pass would just duplicate
+                # work and print the same lines N times
+                if is_main_process:
+                    # One sync per print window instead of one per step
+                    running_loss_val = running_loss.item()
+
+                    # Make sure network is in eval mode for inference
+                    model.eval()
+
+                    # Turn off gradients for validation, saves memory and computations.
+                    # Peel only the DDP layer to keep collectives out of this
+                    # rank-0-only pass; the compile/ClassifierHead wrappers
+                    # must stay on for the forward
+                    with torch.no_grad():
+                        validation_loss, accuracy = validation(getattr(model, "module", model), validloader, criterion, device)
+
+                    print("Epoch: {}/{}.. ".format(e+1, epochs),
+                          "Training Loss: {:.3f}.. ".format(running_loss_val/print_every),
+                          "Validation Loss: {:.3f}.. ".format(validation_loss/len(validloader)),
+                          "Validation Accuracy: {:.3f}".format(accuracy*100))
+
+                    model.train()
+                    unwrap_model(model).features.eval()
+
+                running_loss.zero_()
+
+        if not is_main_process:
+            continue
+
+        # The print window never fires on small loaders (e.g. the 4-step
+        # epochs of --cache_features), so refresh accuracy at epoch end
+        # rather than relying on a value assigned inside the window
+        model.eval()
+        with torch.no_grad():
+            _, accuracy = validation(getattr(model, "module", model), validloader, criterion, device)
+        model.train()
+        unwrap_model(model).features.eval()
+
         is_best = accuracy > best_accuracy
         best_accuracy = max(accuracy, best_accuracy)
-        save_checkpoint({
+
+        # Wait for the previous save before reusing the shadow tensors
+        if save_future is not None:
+            save_future.result()
+
+        # Checkpoint the underlying module so keys carry no DDP/compile
+        # wrapper prefixes; flatten the CheckpointedFeatures nesting so
+        # the keys match a stock torchvision model in predict.py
+        plain_model = unwrap_model(model)
+        state_dict = {k.replace("features.features.", "features.", 1): v
+                      for k, v in plain_model.state_dict().items()}
+
+        # With --quantize_backbone the live features.* keys are qint8 and
+        # would not load into a stock float model; substitute the float
+        # state snapshotted before convert_fx
+        if hasattr(plain_model, "float_features_state"):
+            state_dict = {k: v for k, v in state_dict.items() if not k.startswith("features.")}
+            state_dict.update({"features." + k: v for k, v in plain_model.float_features_state.items()})
+        if shadow_state is None:
+            shadow_state = {k: torch.empty_like(v, device="cpu") for k, v in state_dict.items()}
+            if device == "cuda":
+                shadow_state = {k: v.pin_memory() for k, v in shadow_state.items()}
+        for k, v in state_dict.items():
+            shadow_state[k].copy_(v, non_blocking=True)
+        if device == "cuda":
+            torch.cuda.synchronize()
+
+        # Snapshot the classifier and optimizer state too — handing the
+        # background thread the live tensors would let the next epoch's
+        # optimizer.step() mutate them mid-pickle
+        classifier_snapshot = copy.deepcopy(plain_model.classifier).cpu()
+        optimizer_state = optimizer.state_dict()
+        optimizer_state['state'] = {
+            k: {sk: sv.detach().to("cpu", copy=True) if torch.is_tensor(sv) else sv
+                for sk, sv in v.items()}
+            for k, v in optimizer_state['state'].items()
+        }
+
+        save_future = saver.submit(save_checkpoint, {
             'epoch': epochs,
-            'classifier': model.classifier,
-            'state_dict': model.state_dict(),
-            'optimizer' : optimizer.state_dict(),
-            'class_idx_mapping': model.class_idx_mapping,
+            'classifier': classifier_snapshot,
+            'state_dict': shadow_state,
+            'optimizer' : optimizer_state,
+            'class_idx_mapping': plain_model.class_idx_mapping,
             'arch': arch,
-            'best_accuracy': (best_accuracy/len(validloader))*100
+            'best_accuracy': best_accuracy*100
             }, is_best, model_dir, 'checkpoint.pth')
 
+    # Make sure the last checkpoint hit disk before returning
+    if save_future is not None:
+        save_future.result()
+    saver.shutdown()
+
 def save_checkpoint(state, is_best=False, model_dir="models", filename='checkpoint.pth'):
     torch.save(state, os.path.join(model_dir, filename))
     if is_best:
-        shutil.copyfile(filename, os.path.join(model_dir,'model_best.pth'))
+        shutil.copyfile(os.path.join(model_dir, filename), os.path.join(model_dir,'model_best.pth'))
 
 
-def check_accuracy_on_test(testloader, model):    
-    correct = 0
+def check_accuracy_on_test(testloader, model):
+    correct = torch.zeros((), device='cuda')
     total = 0
     model.to('cuda')
+
+    mean = torch.tensor(IMAGENET_MEAN, device='cuda').view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD, device='cuda').view(1, 3, 1, 1)
+
     with torch.no_grad():
         for data in testloader:
             images, labels = data
             images, labels = images.to('cuda'), labels.to('cuda')
+            # Loaders emit raw uint8 batches; normalize on the device
+            if images.dtype == torch.uint8:
+                images = images.float().div_(255).sub_(mean).div_(std)
             outputs = model(images)
-            _, predicted = torch.max(outputs.data, 1)
+            predicted = outputs.argmax(dim=1)
             total += labels.size(0)
-            correct += (predicted == labels).sum().item()
+            correct += (predicted == labels).sum()
+
+    return 100 * correct.item() / total
+
+
+class CheckpointedFeatures(nn.Module):
+    """
+    Recomputes backbone activations during backward instead of storing
+    them, roughly halving activation memory for a ~25% per-step cost.
+
+    Only pays off when the backbone is unfrozen for fine-tuning; with the
+    stock frozen backbone there is nothing to recompute for and the
+    wrapper falls back to a plain forward.
+    """
+    def __init__(self, features, segments=4):
+        super().__init__()
+        self.features = features
+        self.segments = segments
+
+    def forward(self, x):
+        # Image batches never require grad themselves, so gate on the
+        # backbone params; non-reentrant checkpointing handles that case
+        if self.training and any(p.requires_grad for p in self.features.parameters()):
+            return checkpoint_sequential(self.features, self.segments, x, use_reentrant=False)
+        return self.features(x)
+
+
+class ClassifierHead(nn.Module):
+    """
+    Trains only the classifier on features cached by precompute_features().
+
+    Exposes the wrapped full model via `_orig_mod` (the same attribute a
+    torch.compile'd model uses), so checkpoints written by train() still
+    contain the complete model state and load in predict.py.
+    """
+    def __init__(self, model):
+        super().__init__()
+        self._orig_mod = getattr(model, "_orig_mod", model)
+        self.classifier = self._orig_mod.classifier
+        self.features = self._orig_mod.features
+        self.class_idx_mapping = self._orig_mod.class_idx_mapping
+
+    def forward(self, features):
+        return self.classifier(features)
+
+
+def precompute_features(model, dataloader, device):
+    """
+    Runs the frozen backbone once over a dataloader and caches the pooled,
+    flattened features in host memory.
+
+    Arguments:
+        model: Model with a frozen `features` backbone.
+        dataloader: Dataloader yielding (images, labels) batches.
+        device: Device to run the extraction on.
+
+    Returns:
+        feature_loader: Dataloader over (features, labels) at a large batch size.
+    """
+    mean = torch.tensor(IMAGENET_MEAN, device=device).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD, device=device).view(1, 3, 1, 1)
+
+    model.to(device)
+    model.eval()
+
+    features, targets = [], []
+    with torch.no_grad():
+        for images, labels in dataloader:
+            images = images.to(device, non_blocking=True).to(memory_format=torch.channels_last)
+            if images.dtype == torch.uint8:
+                images = images.float().div_(255).sub_(mean).div_(std)
+
+            with torch.autocast("cuda", dtype=amp_dtype(device), enabled=(device == "cuda")):
+                feats = model.features(images)
+                if hasattr(model, "avgpool"):
+                    feats = model.avgpool(feats)
+                else:
+                    # DenseNet pools in its functional forward
+                    feats = F.adaptive_avg_pool2d(F.relu(feats), (1, 1))
+
+            features.append(torch.flatten(feats, 1).cpu())
+            targets.append(labels)
+
+    dataset = TensorDataset(torch.cat(features), torch.cat(targets))
+    # The classifier is tiny, so batches can be much larger than for images
+    return DataLoader(dataset, shuffle=True, batch_size=2048)
+
+
+def quantize_backbone(model, dataloader, num_calibration_batches=4):
+    """
+    Converts the frozen backbone to int8 via FX graph mode quantization.
+
+    Once frozen, the backbone is a pure inference workload, so its
+    Conv2d+ReLU blocks can run as quantized::conv2d_relu int8 kernels
+    (VNNI dot products on x86). Only the backbone is converted; the
+    trained classifier stays float.
+
+    Arguments:
+        model: Model with a frozen `features` backbone, on CPU.
+        dataloader: Dataloader used to calibrate the activation observers.
+        num_calibration_batches: Batches to run through the observers.
+
+    Returns:
+        model: The model with `features` replaced by the int8 module.
+    """
+    model = getattr(model, "_orig_mod", model)
+    model.eval()
 
-    return 100 * correct / total
+    mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
 
+    def normalize(images):
+        if images.dtype == torch.uint8:
+            images = images.float().div_(255).sub_(mean).div_(std)
+        return images
 
-def load_data_folder(data_folder="data"):
+    example_images, _ = next(iter(dataloader))
+    qconfig_mapping = get_default_qconfig_mapping("x86")
+    backbone = prepare_fx(model.features, qconfig_mapping, example_inputs=(normalize(example_images),))
+
+    with torch.no_grad():
+        for i, (images, _) in enumerate(dataloader):
+            if i >= num_calibration_batches:
+                break
+            backbone(normalize(images))
+
+    # Keep the float backbone state around: checkpoints must stay loadable
+    # by the stock float model predict.py rebuilds, and the frozen backbone
+    # never changes, so this snapshot stays valid for every save
+    model.float_features_state = copy.deepcopy(model.features.state_dict())
+
+    model.features = convert_fx(backbone)
+    return model
+
+
+def jpeg_draft_loader(path):
+    """
+    ImageFolder loader that lets libjpeg downscale during decode.
+
+    The validation pipeline only needs 256px images, so draft() tells the
+    JPEG decoder to do the IDCT at a reduced scale, cutting decode work by
+    up to 4x. For the full CPU-side speedup install the drop-in PIL
+    replacement: pip install pillow-simd (with libjpeg-turbo).
+
+    Arguments:
+        path: Path to the image file.
+
+    Returns:
+        img: Decoded RGB PIL image.
+    """
+    img = Image.open(path)
+    img.draft("RGB", (256, 256))
+    return img.convert("RGB")
+
+
+def load_data_folder(data_folder="data", augment=True, distributed=False):
     """
     Loads the dataset into a dataloader.
 
     Arguments:
         data_folder: Path to the folder where data resides. Should have two sub folders named "train" and "valid".
+        augment: Whether to apply random augmentation to the train set.
+            Disabled when features are precomputed once.
+        distributed: Shard the train set across DDP ranks with a
+            DistributedSampler instead of plain shuffling.
 
     Returns:
         train_dataloader: Train dataloader iterator.
@@ -126,38 +469,50 @@ def load_data_folder(data_folder="data"):
 
     train_dir = os.path.join(data_folder, "train")
     valid_dir = os.path.join(data_folder, "valid")
-    # Define transforms for the training, validation, and testing sets
-    train_transforms = transforms.Compose([
-        transforms.RandomRotation(30),
-        transforms.RandomResizedCrop(size=224),
-        transforms.RandomHorizontalFlip(),
-        transforms.RandomVerticalFlip(),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-    ])
-
+    # Define transforms for the training, validation, and testing sets.
+    # Both pipelines yield uint8 tensors; the float cast and mean/std
+    # normalization run as one fused kernel over the whole batch on the GPU
     validation_transforms = transforms.Compose([
         transforms.Resize(256),
         transforms.CenterCrop(224),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        transforms.PILToTensor()
     ])
 
+    if augment:
+        # Train-time augmentation runs as uint8 tensor ops (transforms.v2)
+        train_transforms = v2.Compose([
+            v2.PILToTensor(),
+            v2.RandomRotation(30),
+            v2.RandomResizedCrop(size=224, antialias=True),
+            v2.RandomHorizontalFlip(),
+            v2.RandomVerticalFlip(),
+        ])
+    else:
+        train_transforms = validation_transforms
+
     # Load the datasets with ImageFolder
     train_dataset = datasets.ImageFolder(train_dir, transform=train_transforms)
-    validation_dataset = datasets.ImageFolder(valid_dir, transform=validation_transforms)
+    validation_dataset = datasets.ImageFolder(valid_dir, transform=validation_transforms, loader=jpeg_draft_loader)
 
     # Using the image datasets and the transforms, define the dataloaders
-    train_dataloader = DataLoader(train_dataset, shuffle=True, batch_size=64, num_workers=4)
-    valid_dataloader = DataLoader(validation_dataset, shuffle=True, batch_size=64, num_workers=4)
+    # Keep workers alive across epochs and prefetch deeper; drop_last on the
+    # train loader gives cuDNN benchmark a single fixed batch shape
+    num_workers = os.cpu_count() or 8
+    if distributed:
+        train_sampler = DistributedSampler(train_dataset)
+        train_dataloader = DataLoader(train_dataset, sampler=train_sampler, batch_size=64, num_workers=num_workers,
+                                      pin_memory=True, persistent_workers=True, prefetch_factor=4, drop_last=True)
+    else:
+        train_dataloader = DataLoader(train_dataset, shuffle=True, batch_size=64, num_workers=num_workers,
+                                      pin_memory=True, persistent_workers=True, prefetch_factor=4, drop_last=True)
+    valid_dataloader = DataLoader(validation_dataset, shuffle=True, batch_size=64, num_workers=num_workers,
+                                  pin_memory=True, persistent_workers=True, prefetch_factor=4)
 
     return train_dataloader, valid_dataloader, train_dataset.class_to_idx
 
-def build_model(arch="vgg16", hidden_units=4096, class_idx_mapping=None):
-    my_local = dict()
-    exec("model = models.{}(pretrained=True)".format(arch), globals(), my_local)
-
-    model =  my_local['model']
+def build_model(arch="vgg16", hidden_units=4096, class_idx_mapping=None, grad_checkpoint=False):
+    model_fn = getattr(models, arch)
+    model = model_fn(weights='DEFAULT')
     last_child = list(model.children())[-1]
 
     if type(last_child) == torch.nn.modules.linear.Linear:
@@ -168,17 +523,33 @@ def build_model(arch="vgg16", hidden_units=4096, class_idx_mapping=None):
     for param in model.parameters():
         param.requires_grad = False
 
+    # Frozen BN layers (DenseNet) should not keep updating running stats
+    for m in model.modules():
+        if isinstance(m, (nn.BatchNorm1d, nn.BatchNorm2d)):
+            m.eval()
+            m.track_running_stats = False
+
+    # Raw logits: CrossEntropyLoss fuses log_softmax+NLL in one kernel
     classifier = nn.Sequential(OrderedDict([
                                             ('fc1', nn.Linear(input_features, hidden_units)),
                                             ('relu', nn.ReLU()),
                                             ('dropout', nn.Dropout(p=0.5)),
-                                            ('fc2', nn.Linear(hidden_units, 102)),
-                                            ('output', nn.LogSoftmax(dim=1))
+                                            ('fc2', nn.Linear(hidden_units, 102))
                                             ]))
     
     model.classifier = classifier
     model.class_idx_mapping = class_idx_mapping
 
+    if grad_checkpoint:
+        model.features = CheckpointedFeatures(model.features)
+
+    # NHWC layout lets cuDNN pick Tensor-Core conv kernels
+    model = model.to(memory_format=torch.channels_last)
+
+    # Fuse kernels and specialize for the fixed 64x3x224x224 input shape
+    if torch.cuda.is_available():
+        model = torch.compile(model, mode="max-autotune", fullgraph=False)
+
     return model
 
 def main():
@@ -204,33 +575,92 @@ def main():
 
     ap.add_argument("--model_dir", help="Directory which will contain the model checkpoints.",
                     default="models")
+
+    ap.add_argument("--cache_features", help="Precompute frozen-backbone features once and train only the classifier. Disables train-time augmentation.",
+                    action="store_true")
+
+    ap.add_argument("--quantize_backbone", help="Quantize the frozen backbone to int8 (CPU only).",
+                    action="store_true")
+
+    ap.add_argument("--grad_checkpoint", help="Recompute backbone activations in backward to halve activation memory; roughly doubles the achievable batch size when fine-tuning an unfrozen backbone.",
+                    action="store_true")
     args = vars(ap.parse_args())
 
     os.system("mkdir -p " + args["model_dir"])
 
-    (train_dataloader, valid_dataloader, class_idx_mapping) = load_data_folder(data_folder=args["data_dir"])
+    # torchrun --nproc_per_node=N train.py ... sets LOCAL_RANK; without it
+    # the script runs single-process as before
+    local_rank = int(os.environ.get("LOCAL_RANK", -1))
+    distributed = local_rank >= 0
+    if distributed:
+        dist.init_process_group("nccl")
+        torch.cuda.set_device(local_rank)
+
+    (train_dataloader, valid_dataloader, class_idx_mapping) = load_data_folder(data_folder=args["data_dir"],
+                                                                               augment=not args["cache_features"],
+                                                                               distributed=distributed)
     
-    model = build_model(arch=args["arch"], hidden_units=args["hidden_units"], class_idx_mapping=class_idx_mapping)
+    model = build_model(arch=args["arch"], hidden_units=args["hidden_units"], class_idx_mapping=class_idx_mapping,
+                        grad_checkpoint=args["grad_checkpoint"])
 
-    criterion = nn.NLLLoss()
-    optimizer = optim.Adam(model.classifier.parameters(), lr=args["learning_rate"])
+    criterion = nn.CrossEntropyLoss()
 
     device = None
-    if args["gpu"]:
+    if args["gpu"] or distributed:
         device = "cuda"
     else:
         device = "cpu"
 
-    train(model=model, 
-        trainloader=train_dataloader, 
+    if args["quantize_backbone"]:
+        if device == "cpu":
+            model = quantize_backbone(model, train_dataloader)
+        else:
+            print("--quantize_backbone targets the CPU int8 backend, ignoring it on CUDA.")
+
+    # fused Adam updates all classifier params in one CUDA kernel, but
+    # needs the params on the device already; foreach is the CPU analogue
+    model.to(device)
+    if device == "cuda":
+        optimizer = optim.Adam(model.classifier.parameters(), lr=args["learning_rate"], fused=True)
+    else:
+        optimizer = optim.Adam(model.classifier.parameters(), lr=args["learning_rate"], foreach=True)
+
+    # Input shapes are fixed (64x3x224x224), so let cuDNN benchmark conv
+    # algorithms once and allow TF32 matmuls on Ampere+ GPUs
+    torch.backends.cudnn.benchmark = True
+    torch.set_float32_matmul_precision("high")
+    torch.backends.cuda.matmul.allow_tf32 = True
+
+    if args["cache_features"]:
+        # The backbone is frozen, so running it every epoch is pure waste:
+        # extract features once and train only the classifier on them
+        train_dataloader = precompute_features(model, train_dataloader, device)
+        valid_dataloader = precompute_features(model, valid_dataloader, device)
+        model = ClassifierHead(model)
+
+    if distributed:
+        # Frozen params are already excluded from DDP buckets, so the
+        # per-step allreduce only carries the classifier gradients
+        model = DDP(model, device_ids=[local_rank])
+
+    # Loss scaling keeps FP16 gradients from underflowing; BF16 has the
+    # FP32 exponent range, so the scaler stays disabled there (and on CPU)
+    scaler = torch.cuda.amp.GradScaler(enabled=(amp_dtype(device) == torch.float16 and device == "cuda"))
+
+    train(model=model,
+        trainloader=train_dataloader,
         validloader=valid_dataloader,
-        epochs=args["epochs"], 
-        print_every=20, 
+        epochs=args["epochs"],
+        print_every=20,
         criterion=criterion,
         optimizer=optimizer,
+        scaler=scaler,
         arch=args["arch"],
         device=device,
         model_dir=args["model_dir"])
 
+    if distributed:
+        dist.destroy_process_group()
+
 if __name__ == '__main__':
     main()
\ No newline at end of file